@@ -2,7 +2,6 @@
 # The test dataset at different time intervals can be downloaded from https://github.com/chacehoo/IFEEL/tree/main/Test_Data
 # The downloaded datasets need to be placed under the current working directory.
 
-import numpy as np
 import pandas as pd
 import os
 from IFEEL import ifeel_transformation, ifeel_extraction
@@ -31,24 +30,16 @@ alphabet_size = 7    # alphabet size of SAX representation
 # Data transformation
 [df_raw, df_raw_diff, df_SAX_number, df_SAX_alphabet, df_SAX_number_diff] = ifeel_transformation.feature_transformation(df_test, alphabet_size,time_business_start,time_business_end)
 
-# Global feature extraction for each daily profile
-feature_global_all_days = pd.DataFrame()
-for i in np.arange(0, df_raw.shape[0]):
-    ts = df_raw.iloc[i]
-    ts_diff = df_raw_diff.iloc[i]
-    feature_global_all_each = ifeel_extraction.feature_global(ts, ts_diff, sample_interval_in_hour).global_all().T
-    feature_global_all_days = feature_global_all_days.append(feature_global_all_each, ignore_index=True)
-
-feature_global_all_days.columns = ifeel_extraction.feature_name_global
+# Global feature extraction for all daily profiles at once
+feature_global_all_days = ifeel_extraction.feature_global_batch(df_raw, df_raw_diff, sample_interval_in_hour)
 feature_global_all_days.head()
 
-# Peak feature extraction for each daily profile
-feature_peak_period_all_days = pd.DataFrame()
-for i in np.arange(0, df_raw.shape[0]):
-    ts_sax = df_SAX_number.iloc[i]
-    ts_sax_diff = df_SAX_number_diff.iloc[i]
-    feature_peak_all_each = ifeel_extraction.feature_peak_period(ts_sax, ts_sax_diff,alphabet_size, sample_interval_in_hour).T
-    feature_peak_period_all_days = feature_peak_period_all_days.append(feature_peak_all_each, ignore_index=True)
+# The global features of a single daily profile can also be extracted with feature_global, e.g., for the first day:
+# ifeel_extraction.feature_global(df_raw.iloc[0], df_raw_diff.iloc[0], sample_interval_in_hour).global_all()
 
-feature_peak_period_all_days.columns = ifeel_extraction.feature_name_peak
-feature_global_all_days.head()
+# Peak feature extraction for all daily profiles at once
+feature_peak_period_all_days = ifeel_extraction.feature_peak_period_batch(df_SAX_number, df_SAX_number_diff, alphabet_size, sample_interval_in_hour)
+feature_peak_period_all_days.head()
+
+# The peak-period features of a single daily profile can also be extracted with feature_peak_period, e.g., for the first day:
+# ifeel_extraction.feature_peak_period(df_SAX_number.iloc[0], df_SAX_number_diff.iloc[0], alphabet_size, sample_interval_in_hour)
@@ -12,4 +12,9 @@ General:
 """
 
 from . import ifeel_extraction
-from . import ifeel_transformation
\ No newline at end of file
+from . import ifeel_transformation
+from . import ifeel_pipeline
+from . import ifeel_ingest
+from . import ifeel_store
+from . import ifeel_online
+from . import ifeel_profiling
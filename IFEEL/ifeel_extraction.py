@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 from scipy.stats import skew, kurtosis
-import itertools
+from . import ifeel_profiling
 
 # Names of all global and peak-period features
 feature_name_global = [
@@ -35,6 +35,26 @@ feature_name_peak = [
 # The units of "Peak_longest: upward slope" and "Peak_longest: downward slope" are per sampling interval.
 
 
+def _run_length_encoding(mask):
+    """
+    This method finds all runs (sub-sequences of consecutive True values) along the rows of a 2-D boolean array.
+    Examples:
+    mask = [[0,1,1,0,1],
+            [1,1,1,0,0]]
+    _run_length_encoding(mask)
+    (array([0, 0, 1]), array([1, 4, 0]), array([2, 1, 3]))
+    mask: A 2-D array containing only 1, True, 0 and False values (days x intervals)
+    return: Three arrays with the row id, start index and length of every run, sorted by row and then by start.
+    """
+    mask = np.asarray(mask)
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask == 1
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    return rows, starts, ends - starts
+
+
 def _get_length_sequences_where(x):   # Python will not import methods whose names are with a leading underscore
     """
     This method calculates the length of all sub-sequences where the array x is either True or 1.
@@ -49,13 +69,138 @@ def _get_length_sequences_where(x):   # Python will not import methods whose nam
     if len(x) == 0:
         return [0]
     else:
-        res = [len(list(group)) for value, group in itertools.groupby(x) if value == 1]
+        res = _run_length_encoding(np.asarray(x).reshape(1, -1))[2].tolist()
         return res if len(res) > 0 else [0]
 
 ###################################
 #### global feature extraction ####
 ###################################
 
+# Array kernels shared by feature_global (one daily profile) and feature_global_batch (all daily profiles).
+# Each takes a 2-D array (days x intervals) and returns one value per row. NaNs are skipped in the same way
+# as pandas' Series.mean() / std() / max() / min() / sum().
+
+def _rows(x):
+    # x as a row-contiguous float array. numpy sums each contiguous row pairwise, in the same order as pandas sums a
+    # Series, whereas the column-major arrays given by DataFrame.to_numpy() are summed in another order: row sums (and
+    # the features built on them) only match those of the row-by-row implementation to the last digit this way.
+    return np.ascontiguousarray(x, dtype=float)
+
+
+def _row_mean(x):
+    mask = np.isnan(x)
+    with np.errstate(invalid='ignore'):
+        return np.where(mask, 0, x).sum(axis=1) / (~mask).sum(axis=1)
+
+
+def _row_std(x, mean):
+    mask = np.isnan(x)
+    sqr = np.where(mask, 0, (x - mean[:, None]) ** 2)
+    with np.errstate(invalid='ignore'):
+        return np.sqrt(sqr.sum(axis=1) / (~mask).sum(axis=1))
+
+
+def _row_max(x):
+    return np.fmax.reduce(x, axis=1)
+
+
+def _row_min(x):
+    return np.fmin.reduce(x, axis=1)
+
+
+def _row_percentage_above(x, mean):
+    return (x > mean[:, None]).sum(axis=1) / x.shape[1]
+
+
+def _row_sum(x, column_mask):
+    return _rows(np.nan_to_num(x[:, column_mask], nan=0.0)).sum(axis=1)
+
+
+def _row_moment_stat(stat, x):
+    # scipy.stats.skew / kurtosis of each row; rows containing NaN give NaN (nan_policy='propagate').
+    # Only complete rows are passed to scipy, which otherwise falls back to a slow row-by-row loop.
+    # Constant rows give NaN as in scipy, without its warning about catastrophic cancellation.
+    result = np.full(x.shape[0], np.nan)
+    complete = ~np.isnan(x).any(axis=1)
+    complete[complete] = np.ptp(x[complete], axis=1) > 0
+    if complete.any():
+        result[complete] = stat(x[complete], axis=1)
+    return result
+
+
+def _row_mode_histogram(x, x_min, x_max, bins=5):
+    # Centre of the most populated bin of an equal-width histogram of each row.
+    # Follows the binning of np.histogram(ts, bins=bins) exactly, with NaNs left out of the counts.
+    first_edge = np.where(x_min == x_max, x_min - 0.5, x_min)
+    last_edge = np.where(x_min == x_max, x_max + 0.5, x_max)
+    edges = np.linspace(first_edge, last_edge, bins + 1, axis=1)
+    valid = ~np.isnan(x)
+    with np.errstate(invalid='ignore'):
+        f_indices = ((x - first_edge[:, None]) / (last_edge - first_edge)[:, None]) * bins
+    indices = np.where(valid, f_indices, 0).astype(np.intp)
+    indices[indices == bins] -= 1
+    indices[x < np.take_along_axis(edges, indices, axis=1)] -= 1
+    increment = (x >= np.take_along_axis(edges, indices + 1, axis=1)) & (indices != bins - 1)
+    indices[increment] += 1
+    rows = np.broadcast_to(np.arange(x.shape[0])[:, None], x.shape)
+    hist = np.bincount((rows * bins + indices)[valid], minlength=x.shape[0] * bins).reshape(-1, bins)
+    index_max = np.argmax(hist, axis=1)[:, None]
+    mode = (np.take_along_axis(edges, index_max, axis=1) + np.take_along_axis(edges, index_max + 1, axis=1)) / 2
+    return np.where(np.isnan(x_min), np.nan, mode[:, 0])
+
+
+def _longest_run_where(mask):
+    # Length of the longest run of True values along each row of a 2-D boolean array (0 if there is none)
+    rows, starts, lengths = _run_length_encoding(mask)
+    longest = np.zeros(mask.shape[0], dtype=np.intp)
+    np.maximum.at(longest, rows, lengths)
+    return longest
+
+
+def _global_features(x, x_diff, busi_mask, sample_interval):
+    # All 13 global features (columns, in the order of feature_name_global) for every row of x
+    # Each feature is a profiling stage 'global: <feature name>' (see ifeel_profiling)
+    x = _rows(x)
+    n_rows = x.shape[0]
+
+    def timed(name, function, *args):
+        with ifeel_profiling.stage('global: ' + name, n_rows):
+            return function(*args)
+
+    mean = timed('Mean', _row_mean, x)
+    x_max = timed('Max', _row_max, x)
+    x_min = timed('Min', _row_min, x)
+    return np.column_stack([
+        mean,
+        timed('Std', _row_std, x, mean),
+        x_max,
+        x_min,
+        timed('Range (i.e., max-min)', np.subtract, x_max, x_min),
+        timed('Percentage above mean', _row_percentage_above, x, mean),
+        timed('Sum of net loads during business hours', _row_sum, x, busi_mask),
+        timed('Sum of net loads during non-business hours', _row_sum, x, ~busi_mask),
+        timed('Skewness', _row_moment_stat, skew, x),
+        timed('Kurtosis', _row_moment_stat, kurtosis, x),
+        timed('Mode of 5-bin histogram', _row_mode_histogram, x, x_min, x_max),
+        sample_interval * timed('Longest period above mean', _longest_run_where, x > mean[:, None]),
+        sample_interval * timed('Longest period of successive increase', _longest_run_where, x_diff > 0)])
+
+
+def _business_hour_level(index):
+    # Business-hour flags of the MultiIndex built by ifeel_transformation.feature_transformation
+    return np.asarray(index.get_level_values('business_hour') == True)
+
+
+def feature_global_batch(df_raw, df_raw_diff, sample_interval):
+    # Global features of all daily profiles in one call
+    # df_raw, df_raw_diff: the first two outputs of ifeel_transformation.feature_transformation
+    # return: a DataFrame with one row per daily profile and the columns in feature_name_global
+    x = df_raw.to_numpy(dtype=float)
+    x_diff = df_raw_diff.to_numpy(dtype=float)
+    features = _global_features(x, x_diff, _business_hour_level(df_raw.columns), sample_interval)
+    return pd.DataFrame(features, index=df_raw.index, columns=feature_name_global)
+
+
 class feature_global(object):   # Class is a “template” / “blueprint” that is used to create objects.
 
     # Attribute references
@@ -67,143 +212,151 @@ class feature_global(object):   # Class is a “template” / “blueprint” th
         self.ts_diff = ts_diff
         self.sample_interval = sample_interval
 
+    # the daily profile as a one-row array, so that the batch kernels above can be reused
+    def _row(self):
+        return np.asarray(self.ts, dtype=float).reshape(1, -1)
+
+    def _row_diff(self):
+        return np.asarray(self.ts_diff, dtype=float).reshape(1, -1)
+
     # a method is an action which an object is able to perform.
     def global_mean(self):
-        return np.mean(self.ts)
+        return _row_mean(self._row())[0]
 
     def global_std(self):
-        return np.std(self.ts)
+        x = self._row()
+        return _row_std(x, _row_mean(x))[0]
 
     def global_max(self):
-        return np.max(self.ts)
+        return _row_max(self._row())[0]
 
     def global_min(self):
-        return np.min(self.ts)
+        return _row_min(self._row())[0]
 
     def global_range(self):
-        return np.max(self.ts)-np.min(self.ts)
+        x = self._row()
+        return (_row_max(x) - _row_min(x))[0]
 
     def global_percentage_above_mean(self):
-        percentage = sum(i > np.mean(self.ts) for i in self.ts) / len(self.ts)
-        return percentage
+        x = self._row()
+        return _row_percentage_above(x, _row_mean(x))[0]
 
     def global_sum_net_loads_busi(self):
-        x = self.ts
-        ts_busi = x.loc[x.index.get_level_values('business_hour') == True]
-        sum_busi = np.sum(ts_busi)
-        return sum_busi
+        return _row_sum(self._row(), _business_hour_level(self.ts.index))[0]
 
     def global_sum_net_loads_nonbusi(self):
-        x = self.ts
-        ts_non_busi = x.loc[x.index.get_level_values('business_hour') == False]
-        sum_non_busi = np.sum(ts_non_busi)
-        return sum_non_busi
+        return _row_sum(self._row(), ~_business_hour_level(self.ts.index))[0]
 
     def global_skewness(self):
-        skewness = skew(self.ts)
-        return skewness
+        return _row_moment_stat(skew, self._row())[0]
 
     def global_kurtosis(self):
-        kurtosis_value = kurtosis(self.ts)
-        return kurtosis_value
+        return _row_moment_stat(kurtosis, self._row())[0]
 
     def global_mode_histogram_bins5(self):
-        hist, edges = np.histogram(self.ts, bins=5)
-        index_max = np.argmax(hist)
-        mode_range = [edges[index_max], edges[index_max + 1]]
-        mode = np.mean(mode_range)
-        return mode
+        x = self._row()
+        return _row_mode_histogram(x, _row_min(x), _row_max(x))[0]
 
     def global_longest_period_above_mean(self):
         # Returns the length of the longest consecutive subsequence in x that is bigger than the mean of x
-        x = self.ts
-        y = self.sample_interval
-        if not isinstance(x, (np.ndarray, pd.Series)):
-            x = np.asarray(x)     # Convert the input to an array
-        return y*np.max(_get_length_sequences_where(x > np.mean(x))) if x.size > 0 else 0
+        x = self._row()
+        return self.sample_interval * _longest_run_where(x > _row_mean(x)[:, None])[0]
 
     def global_longest_period_of_successive_increase(self):
-        # Returns the length of the longest consecutive increase using SAX difference word (df_SAX_number_diff_pivot)
-        x = self.ts_diff
-        y = self.sample_interval
-        if not isinstance(x, (np.ndarray, pd.Series)):
-            x = np.asarray(x)
-
-        return y*np.max(_get_length_sequences_where(x > 0)) if x.size > 0 else 0
+        # Returns the length of the longest consecutive increase using the difference of raw data (df_raw_diff)
+        return self.sample_interval * _longest_run_where(self._row_diff() > 0)[0]
 
     def global_all(self):
         # Get all time domain features in one function
-        # return: all time domain features in a list
-        feature_all = list()
-        feature_all.append(self.global_mean())
-        feature_all.append(self.global_std())
-        feature_all.append(self.global_max())
-        feature_all.append(self.global_min())
-        feature_all.append(self.global_range())
-        feature_all.append(self.global_percentage_above_mean())
-        feature_all.append(self.global_sum_net_loads_busi())
-        feature_all.append(self.global_sum_net_loads_nonbusi())
-        feature_all.append(self.global_skewness())
-        feature_all.append(self.global_kurtosis())
-        feature_all.append(self.global_mode_histogram_bins5())
-        feature_all.append(self.global_longest_period_above_mean())
-        feature_all.append(self.global_longest_period_of_successive_increase())
-        return pd.DataFrame(feature_all)
+        # return: all time domain features in a one-column DataFrame
+        busi_mask = _business_hour_level(self.ts.index)
+        feature_all = _global_features(self._row(), self._row_diff(), busi_mask, self.sample_interval)[0]
+        return pd.DataFrame(list(feature_all))
 
 #################################
 #### peak feature extraction ####
 #################################
-def feature_peak_period(ts_sax_number, ts_sax_number_diff, alphabet_size, sample_interval):
 
+def _peak_features(sax_number, sax_number_diff, alphabet_size, sample_interval):
+    # All 8 peak-period features (in the order of feature_name_peak) for every row of the SAX matrix.
+    # A peak is a run of the highest SAX level; all runs of all rows are found at once and then reduced per row.
+    # return: a list of 8 arrays, one value per row. 'Peak_all: time' and 'Peak_all: duration' are object
+    # arrays holding one array (a value per peak) for each row.
+    sax_number = np.asarray(sax_number, dtype=float)
+    sax_number_diff = np.asarray(sax_number_diff, dtype=float)
+    n_rows, n_columns = sax_number.shape
     peak = alphabet_size-1
-    ts_to_boolean = ts_sax_number == peak
-    peak_index_connected = np.where(ts_to_boolean)[0]  # the return of "where" function is a tuple，[0] is needed to obtain the index
-
-    is_peak_exist = float(peak) in ts_sax_number.values
-    if is_peak_exist==0:
-        peak_number = 0
-        peak_time = np.nan
-        peak_time_diff_shortest = np.nan
-        peak_duration = np.nan
-        peak_longest_time = np.nan
-        peak_longest_duration = np.nan
-        peak_longest_slope_upward = np.nan
-        peak_longest_slope_downward = np.nan
-    else:
-        # Group consecutive integers in an array?
-        # idea: search the points which are not equal to 1 and regard them as the breakpoints.
-        # Use the 'where' function to return the position of these breakpoints.
-        # != means not equal
-        peak_index_separated = np.split(peak_index_connected, np.where(np.diff(peak_index_connected) != 1)[0] + 1)
-        peak_number = len(peak_index_separated)
-        peak_time = np.array([np.mean(i) for i in peak_index_separated]) * sample_interval
-
-        if peak_number == 1:
-            peak_time_diff_shortest = np.nan
-        else:
-            peak_time_diff_shortest = np.min(np.diff(peak_time)) * sample_interval
-
-        peak_duration_points = np.array([len(i) for i in peak_index_separated])
-        peak_duration = peak_duration_points * sample_interval
-        peak_longest_sequence = [i for i in peak_index_separated if len(i) == max(peak_duration_points)][0]  # 1) If Condition in Python List   2) if there are multiple peaks with the same length, then also take the first one
-        peak_longest_time = np.mean(peak_longest_sequence) * sample_interval
-        peak_longest_duration = len(peak_longest_sequence) * sample_interval
-        peak_longest_slope_upward = ts_sax_number_diff[peak_longest_sequence[0]]     # peak_longest_sequence[0]: beginning point index
+    with ifeel_profiling.stage('peak: run-length encoding', n_rows):
+        rows, starts, lengths = _run_length_encoding(sax_number == peak)
+
+    with ifeel_profiling.stage('peak: per-row reductions', n_rows):
+        peak_number = np.bincount(rows, minlength=n_rows)
+        has_peak = peak_number > 0
+        peak_times = (starts + (lengths - 1) / 2) * sample_interval   # mean of the indices of each peak
+        peak_durations = lengths * sample_interval
+
+        # shortest interval between two successive peaks of the same row
+        same_row = rows[1:] == rows[:-1]
+        peak_time_diff_shortest = np.full(n_rows, np.inf)
+        np.minimum.at(peak_time_diff_shortest, rows[1:][same_row], np.diff(peak_times)[same_row])
+        peak_time_diff_shortest = np.where(peak_number > 1, peak_time_diff_shortest * sample_interval, np.nan)
+
+        # the longest peak of each row (if there are multiple peaks with the same length, then take the first one)
+        longest_length = np.zeros(n_rows, dtype=np.intp)
+        np.maximum.at(longest_length, rows, lengths)
+        is_longest = lengths == longest_length[rows]
+        _, first = np.unique(rows[is_longest], return_index=True)
+        longest = np.flatnonzero(is_longest)[first]
+        longest_rows = rows[longest]
+        longest_start = starts[longest]
+        longest_end = longest_start + lengths[longest] - 1
+
+        peak_longest_time = np.full(n_rows, np.nan)
+        peak_longest_time[longest_rows] = peak_times[longest]
+        peak_longest_duration = np.full(n_rows, np.nan)
+        peak_longest_duration[longest_rows] = peak_durations[longest]
+        peak_longest_slope_upward = np.full(n_rows, np.nan)
+        peak_longest_slope_upward[longest_rows] = sax_number_diff[longest_rows, longest_start]
 
         number_window = 24/sample_interval
-        if peak_longest_sequence[-1] == number_window - 1:
-            peak_longest_slope_downward = -1
-        else:
-            peak_longest_slope_downward = ts_sax_number_diff[peak_longest_sequence[-1] + 1]  # peak_longest_sequence[-1]: end point index
-
-    return pd.DataFrame([peak_number,
-                        peak_time,
-                        peak_time_diff_shortest,
-                        peak_duration,
-                        peak_longest_time,
-                        peak_longest_duration,
-                        peak_longest_slope_upward,
-                        peak_longest_slope_downward
-                         ])
+        at_day_end = longest_end == number_window - 1
+        after_end = np.minimum(longest_end + 1, n_columns - 1)
+        peak_longest_slope_downward = np.full(n_rows, np.nan)
+        peak_longest_slope_downward[longest_rows] = np.where(at_day_end, -1, sax_number_diff[longest_rows, after_end])
+
+    # per-peak values of each row
+    with ifeel_profiling.stage('peak: per-peak arrays', n_rows):
+        split_at = np.cumsum(peak_number[has_peak])[:-1]
+        peak_time = np.full(n_rows, np.nan, dtype=object)
+        peak_duration = np.full(n_rows, np.nan, dtype=object)
+        for i, time_i, duration_i in zip(np.flatnonzero(has_peak),
+                                         np.split(peak_times, split_at),
+                                         np.split(peak_durations, split_at)):
+            peak_time[i] = time_i
+            peak_duration[i] = duration_i
+
+    return [peak_number,
+            peak_time,
+            peak_time_diff_shortest,
+            peak_duration,
+            peak_longest_time,
+            peak_longest_duration,
+            peak_longest_slope_upward,
+            peak_longest_slope_downward]
+
+
+def feature_peak_period_batch(df_SAX_number, df_SAX_number_diff, alphabet_size, sample_interval):
+    # Peak-period features of all daily profiles in one call
+    # df_SAX_number, df_SAX_number_diff: the third and fifth outputs of ifeel_transformation.feature_transformation
+    # return: a DataFrame with one row per daily profile and the columns in feature_name_peak
+    features = _peak_features(df_SAX_number, df_SAX_number_diff, alphabet_size, sample_interval)
+    return pd.DataFrame(dict(zip(feature_name_peak, features)), index=df_SAX_number.index)
 
 
+def feature_peak_period(ts_sax_number, ts_sax_number_diff, alphabet_size, sample_interval):
+    # Peak-period features of a single daily profile, returned as a one-column DataFrame
+    features = _peak_features(np.asarray(ts_sax_number, dtype=float).reshape(1, -1),
+                              np.asarray(ts_sax_number_diff, dtype=float).reshape(1, -1),
+                              alphabet_size, sample_interval)
+    peak_number = int(features[0][0])
+    return pd.DataFrame([peak_number] + [feature[0] for feature in features[1:]])
@@ -0,0 +1,133 @@
+import warnings
+import numpy as np
+import pandas as pd
+from . import ifeel_pipeline, ifeel_profiling
+
+_day_ns = 24*3600*10**9   # one day in nanoseconds
+
+
+def _fill_gaps(x, fill, fill_limit=None):
+    # Fill the missing intervals (NaNs) along each row of x
+    # fill: 'ffill' (last reading carried forward), 'interpolate' (linear between the readings around the gap) or None
+    # fill_limit: gaps longer than this number of intervals are left missing (default: no limit)
+    if fill is None:
+        return x
+    if fill not in ('ffill', 'interpolate'):
+        raise ValueError("fill must be 'ffill', 'interpolate' or None, not %r" % fill)
+    missing = np.isnan(x)
+    if not missing.any():
+        return x
+    n_rows, n_columns = x.shape
+    columns = np.arange(n_columns)
+    rows = np.arange(n_rows)[:, None]
+    before = np.maximum.accumulate(np.where(missing, -1, columns), axis=1)   # last reading at or before each interval
+    after = np.minimum.accumulate(np.where(missing, n_columns, columns)[:, ::-1], axis=1)[:, ::-1]   # first at or after
+    to_fill = missing & (before >= 0)
+    if fill == 'interpolate':
+        to_fill &= after < n_columns
+    if fill_limit is not None:
+        to_fill &= (after - before - 1) <= fill_limit
+    x_prev = x[rows, np.maximum(before, 0)]
+    if fill == 'ffill':
+        filled = x_prev
+    else:
+        x_next = x[rows, np.minimum(after, n_columns - 1)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            filled = x_prev + (x_next - x_prev) * (columns - before) / (after - before)
+    return np.where(to_fill, filled, x)
+
+
+def _parse_timestamps(values, timezone):
+    # Timestamps as a DatetimeIndex. Strings whose UTC offset changes (e.g., '+0000' then '+0100' across a daylight
+    # saving time change, as in most exports) do not share one offset: they are parsed as UTC, and the days are then
+    # defined in timezone, which is required in that case.
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)   # pandas 2.x warns about mixed offsets before raising
+            timestamps = pd.to_datetime(values)
+        mixed_offsets = not pd.api.types.is_datetime64_any_dtype(timestamps)
+    except ValueError:
+        mixed_offsets = True
+    if mixed_offsets:
+        timestamps = pd.to_datetime(values, utc=True)
+        if timezone is None:
+            raise ValueError('The timestamps have different UTC offsets (e.g., across a daylight saving time change): '
+                             'give the timezone in which the days are defined, e.g., timezone="Europe/London"')
+    return pd.DatetimeIndex(timestamps)
+
+
+def daily_profiles(df_long, interval='30min', meter_col='meter_id', time_col='timestamp', value_col='value',
+                   timezone=None, agg='mean', fill='ffill', fill_limit=None):
+    # Bin long-format meter readings (one row per meter and timestamp, possibly irregular or with gaps) into one
+    # daily profile per meter and day, at a fixed interval. Everything is vectorized over all meters at once.
+    # interval: a pandas time delta (e.g., '30min', '1h'); one day must be a whole number of intervals
+    # timezone: time zone in which the days are defined. Timezone-aware timestamps are converted to it, while naive
+    #           timestamps are taken as UTC if it is given, and as local time otherwise. It is required when the
+    #           timestamps are strings with different UTC offsets (e.g., '2021-03-28T00:30:00+0000' and
+    #           '2021-03-28T02:00:00+0100').
+    # agg: 'mean' (e.g., power readings) or 'sum' (e.g., energy readings) of the readings falling in an interval
+    # fill, fill_limit: filling of the intervals without any reading, see _fill_gaps
+    # Daylight saving time: the profiles follow the local wall clock, so every day has the same number of intervals.
+    # On the day the clocks go forward, the skipped hour has no reading and is filled like any other gap; on the day
+    # they go back, the readings of the repeated hour are aggregated with those of the first pass.
+    # return: the profiles (2-D array, days x intervals, starting at midnight) and their (meter, date) MultiIndex,
+    #         which can be passed straight to ifeel_pipeline.feature_extractor(...).extract_array
+    interval_ns = pd.Timedelta(interval).value
+    if interval_ns <= 0 or _day_ns % interval_ns != 0:
+        raise ValueError('One day must be a whole number of intervals, which is not the case for %r' % interval)
+    if agg not in ('mean', 'sum'):
+        raise ValueError("agg must be 'mean' or 'sum', not %r" % agg)
+    n_intervals = _day_ns // interval_ns
+
+    timestamps = _parse_timestamps(df_long[time_col], timezone)
+    if timestamps.tz is not None:
+        if timezone is not None:
+            timestamps = timestamps.tz_convert(timezone)
+        timestamps = timestamps.tz_localize(None)   # local wall-clock time
+    elif timezone is not None:
+        timestamps = timestamps.tz_localize('UTC').tz_convert(timezone).tz_localize(None)
+    values = df_long[value_col].to_numpy(dtype=float)
+    keep = ~np.isnan(values) & ~timestamps.isna()
+    meter_codes, meters = pd.factorize(df_long[meter_col].to_numpy()[keep])
+    ns = timestamps.asi8[keep]
+    values = values[keep]
+
+    if len(values) == 0:
+        index = pd.MultiIndex.from_arrays([meters, pd.DatetimeIndex([])], names=[meter_col, 'date'])
+        return np.empty((0, n_intervals)), index
+
+    days = ns // _day_ns
+    slots = (ns - days * _day_ns) // interval_ns
+    first_day = days.min()
+    n_days_span = days.max() - first_day + 1
+    with ifeel_profiling.stage('ingest: binning', len(values)):
+        keys, rows = np.unique(meter_codes * n_days_span + (days - first_day), return_inverse=True)
+        flat = rows * n_intervals + slots
+        size = len(keys) * n_intervals
+        profiles = np.bincount(flat, weights=values, minlength=size)
+        counts = np.bincount(flat, minlength=size)
+        if agg == 'mean':
+            with np.errstate(invalid='ignore'):
+                profiles = profiles / counts
+        else:
+            profiles[counts == 0] = np.nan
+    with ifeel_profiling.stage('ingest: gap filling', len(keys)):
+        profiles = _fill_gaps(profiles.reshape(len(keys), n_intervals), fill, fill_limit)
+
+    dates = pd.to_datetime((keys % n_days_span + first_day) * _day_ns)
+    index = pd.MultiIndex.from_arrays([meters[keys // n_days_span], dates], names=[meter_col, 'date'])
+    return profiles, index
+
+
+def feature_extraction_long(df_long, alphabet_size, time_business_start, time_business_end, interval='30min',
+                            meter_col='meter_id', time_col='timestamp', value_col='value', timezone=None, agg='mean',
+                            fill='ffill', fill_limit=None, features=None, n_jobs=1, paa_segments=None):
+    # Features of every meter and day of long-format readings: daily_profiles followed by
+    # ifeel_pipeline.feature_extractor, without building a wide DataFrame with 'HH:MM:SS' columns in between.
+    # return: a DataFrame with one row per (meter, date) and one column per feature
+    profiles, index = daily_profiles(df_long, interval, meter_col, time_col, value_col, timezone, agg, fill,
+                                     fill_limit)
+    sample_interval = pd.Timedelta(interval) / pd.Timedelta(hours=1)
+    extractor = ifeel_pipeline.feature_extractor(alphabet_size, time_business_start, time_business_end,
+                                                 sample_interval, features, paa_segments)
+    return extractor.extract_array(profiles, index, n_jobs=n_jobs)
@@ -0,0 +1,197 @@
+import copy
+import numpy as np
+import pandas as pd
+from . import ifeel_extraction, ifeel_pipeline, ifeel_transformation
+
+
+class global_accumulator(object):
+    # Global features of one meter-day, updated in O(1) as each reading arrives.
+    # While the day is open, the running values (mean, std, skewness, kurtosis, max, min, business/non-business sums
+    # and runs) are available at any time; the moments use the same conventions as scipy.stats (biased skewness,
+    # Fisher kurtosis). When the day closes, finalize() gives exactly the values of feature_global(...).global_all().
+    # Readings are expected in time order; several readings may fall in the same interval (e.g., 1-min readings for
+    # half-hourly features), and are aggregated as in ifeel_ingest.daily_profiles. A reading for an interval before
+    # that of the last reading is rejected with a ValueError.
+    __slots__ = ('sample_interval', 'busi_mask', 'agg', 'values', 'n', 'mean', 'm2', 'm3', 'm4', 'max', 'min',
+                 'sum_busi', 'sum_nonbusi', 'slot', 'slot_sum', 'slot_count', 'last_added', 'run_increase',
+                 'longest_increase', 'run_above_mean', 'longest_above_mean')
+
+    def __init__(self, sample_interval, busi_mask, agg='mean'):
+        # sample_interval: in the unit of hour
+        # busi_mask: business-hour flag of each interval of the day (see ifeel_pipeline.feature_extractor)
+        # agg: 'mean' (e.g., power readings) or 'sum' (e.g., energy readings) of the readings of an interval
+        if agg not in ('mean', 'sum'):
+            raise ValueError("agg must be 'mean' or 'sum', not %r" % agg)
+        self.sample_interval = sample_interval
+        self.busi_mask = busi_mask
+        self.agg = agg
+        self.values = np.full(len(busi_mask), np.nan)   # kept for the exact features at the end of the day
+        self.n = 0
+        self.mean = self.m2 = self.m3 = self.m4 = 0.0
+        self.max = -np.inf
+        self.min = np.inf
+        self.sum_busi = self.sum_nonbusi = 0.0
+        self.slot = -1          # interval of the last reading, whose aggregate is not added yet
+        self.slot_sum = 0.0
+        self.slot_count = 0
+        self.last_added = -1    # last interval added to the features
+        self.run_increase = self.longest_increase = 0
+        self.run_above_mean = self.longest_above_mean = 0
+
+    def update(self, slot, value):
+        # slot: index of the interval of the day (0 for the interval starting at midnight)
+        # The aggregate of an interval is added to the features when a reading of a later interval arrives (or when
+        # the day is finalized); running() includes the interval in progress.
+        value = float(value)
+        if slot < self.slot:
+            raise ValueError('Reading for interval %d after one for interval %d: readings must be in time order'
+                             % (slot, self.slot))
+        if slot > self.slot:
+            self._close_slot()
+            self.slot = slot
+        if not np.isnan(value):
+            self.slot_sum += value
+            self.slot_count += 1
+
+    def _close_slot(self):
+        # Add the aggregate of the readings of the current interval (if any) to the features
+        if self.slot_count > 0:
+            self._add(self.slot, self.slot_sum / self.slot_count if self.agg == 'mean' else self.slot_sum)
+        self.slot_sum = 0.0
+        self.slot_count = 0
+
+    def _add(self, slot, value):
+        # Update the features with the value of one interval, in O(1)
+        self.values[slot] = value
+
+        # central moments, updated with the one-pass formulas of Pébay (2008)
+        n1 = self.n
+        self.n += 1
+        n = self.n
+        delta = value - self.mean
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n1
+        self.mean += delta_n
+        self.m4 += term1 * delta_n2 * (n*n - 3*n + 3) + 6 * delta_n2 * self.m2 - 4 * delta_n * self.m3
+        self.m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self.m2
+        self.m2 += term1
+
+        self.max = max(self.max, value)
+        self.min = min(self.min, value)
+        if self.busi_mask[slot]:
+            self.sum_busi += value
+        else:
+            self.sum_nonbusi += value
+
+        # increase with respect to the reading of the previous interval (as in df_raw_diff)
+        if slot == self.last_added + 1 and slot > 0 and value > self.values[slot - 1]:
+            self.run_increase += 1
+        else:
+            self.run_increase = 0
+        self.longest_increase = max(self.longest_increase, self.run_increase)
+        # above the running mean (the final mean is only known at the end of the day)
+        if slot == self.last_added + 1 and value > self.mean:
+            self.run_above_mean += 1
+        else:
+            self.run_above_mean = 1 if value > self.mean else 0
+        self.longest_above_mean = max(self.longest_above_mean, self.run_above_mean)
+        self.last_added = slot
+
+    def running(self):
+        # Running global features of the readings received so far (NaN before the first reading). The percentage
+        # above mean and the histogram mode are computed from the readings kept, the others are O(1).
+        # return: a Series indexed by the names in feature_name_global
+        if self.slot_count > 0:
+            # interval in progress: added to a copy, since later readings of the interval may still change it
+            state = copy.copy(self)
+            state.values = self.values.copy()
+            state._close_slot()
+            return state.running()
+        n = self.n
+        if n == 0:
+            return pd.Series(np.nan, index=ifeel_extraction.feature_name_global)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m2 = self.m2 / n
+            skewness = (self.m3 / n) / m2**1.5 if m2 > 0 else np.nan
+            kurtosis_value = (self.m4 / n) / m2**2 - 3 if m2 > 0 else np.nan
+        values = [self.mean,
+                  np.sqrt(m2),
+                  self.max,
+                  self.min,
+                  self.max - self.min,
+                  np.sum(self.values > self.mean) / len(self.values),
+                  self.sum_busi,
+                  self.sum_nonbusi,
+                  skewness,
+                  kurtosis_value,
+                  ifeel_extraction._row_mode_histogram(self.values.reshape(1, -1), np.array([self.min]),
+                                                       np.array([self.max]))[0],
+                  self.sample_interval * self.longest_above_mean,
+                  self.sample_interval * self.longest_increase]
+        return pd.Series(values, index=ifeel_extraction.feature_name_global)
+
+    def finalize(self):
+        # Exact global features of the day, from all the readings received (missing intervals are NaN)
+        # return: a Series indexed by the names in feature_name_global
+        self._close_slot()
+        x = self.values.reshape(1, -1)
+        x_diff = ifeel_pipeline._diff_rows(x)
+        features = ifeel_extraction._global_features(x, x_diff, self.busi_mask, self.sample_interval)[0]
+        return pd.Series(features, index=ifeel_extraction.feature_name_global)
+
+
+class global_accumulator_pool(object):
+    # One global_accumulator per meter for the current day of each meter, e.g., to serve the features of
+    # thousands of meters from a stream of readings. When a reading of a later day arrives for a meter, its previous
+    # day is finalized. Readings falling in the same interval are aggregated with agg ('mean' or 'sum', see
+    # global_accumulator). Late readings, i.e. of a day already finalized or of an interval before that of the last
+    # reading of the current day, are dropped (and counted in n_dropped).
+    # sample_interval: in the unit of hour
+    # time_business_start, time_business_end: business hours, e.g., 9 and 17
+    def __init__(self, sample_interval, time_business_start, time_business_end, agg='mean'):
+        if agg not in ('mean', 'sum'):
+            raise ValueError("agg must be 'mean' or 'sum', not %r" % agg)
+        self.sample_interval = sample_interval
+        self.agg = agg
+        self.n_intervals = int(round(24/sample_interval))
+        self.busi_mask = ifeel_transformation._business_hour_mask_from_interval(
+            self.n_intervals, time_business_start, time_business_end)
+        self.accumulators = {}   # meter -> (date, global_accumulator)
+        self.n_dropped = 0
+
+    def update(self, meter, timestamp, value):
+        # timestamp: local time of the reading (datetime or pandas Timestamp); it is aggregated with the other
+        #            readings of the interval that contains it
+        # return: the finalized features (Series) of the previous day of the meter if this reading starts a new day,
+        #         otherwise None (also when the reading is dropped as late)
+        date = timestamp.date()
+        seconds = timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+        slot = int(seconds // (self.sample_interval * 3600))
+        finalized = None
+        current = self.accumulators.get(meter)
+        if current is not None and (date < current[0] or (date == current[0] and slot < current[1].slot)):
+            self.n_dropped += 1
+            return None
+        if current is None or date > current[0]:
+            if current is not None:
+                finalized = current[1].finalize()
+            current = (date, global_accumulator(self.sample_interval, self.busi_mask, self.agg))
+            self.accumulators[meter] = current
+        current[1].update(slot, value)
+        return finalized
+
+    def running(self, meter):
+        # Running features of the current day of the meter
+        return self.accumulators[meter][1].running()
+
+    def running_all(self):
+        # Running features of the current day of all meters, as a DataFrame indexed by (meter, date)
+        index = pd.MultiIndex.from_tuples([(meter, date) for meter, (date, _) in self.accumulators.items()],
+                                          names=['meter', 'date'])
+        return pd.DataFrame([accumulator.running() for _, accumulator in self.accumulators.values()], index=index)
+
+    def finalize(self, meter):
+        # Close the current day of the meter and return its features
+        date, accumulator = self.accumulators.pop(meter)
+        return accumulator.finalize()
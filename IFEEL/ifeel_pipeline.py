@@ -0,0 +1,290 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.stats import skew, kurtosis
+from . import ifeel_transformation, ifeel_extraction, ifeel_profiling
+
+# Names of all features returned by the pipeline (13 global features followed by 8 peak-period features)
+feature_name_all = ifeel_extraction.feature_name_global + ifeel_extraction.feature_name_peak
+
+# Peak-period features holding one value per peak (a list per daily profile)
+_feature_name_per_peak = ['Peak_all: time', 'Peak_all: duration']
+
+
+def _diff_rows(x):
+    # Same as DataFrame.diff(periods=1, axis=1): the first column is NaN
+    x_diff = np.empty(x.shape)
+    x_diff[:, 0] = np.nan
+    np.subtract(x[:, 1:], x[:, :-1], out=x_diff[:, 1:])
+    return x_diff
+
+
+def _sax_levels_float(x, breakpoints, paa_segments=None):
+    # SAX levels of the rows of x as floats, NaN where the level is undefined (e.g. flat daily profiles)
+    # paa_segments: if given, the levels of the PAA segments (see ifeel_transformation.feature_transformation)
+    y = ifeel_transformation._znorm_rows(ifeel_transformation._ffill_rows(x))
+    if paa_segments is not None:
+        y = ifeel_transformation._paa_rows(y, paa_segments)
+    levels = ifeel_transformation._sax_levels(y, breakpoints).astype(float)
+    levels[levels < 0] = np.nan
+    return levels
+
+
+# Intermediate arrays shared by several features, computed from the raw data of a batch of daily profiles
+_intermediates = {
+    'diff': lambda p: _diff_rows(p.x),
+    'mean': lambda p: ifeel_extraction._row_mean(p.x),
+    'max': lambda p: ifeel_extraction._row_max(p.x),
+    'min': lambda p: ifeel_extraction._row_min(p.x),
+    'levels': lambda p: _sax_levels_float(p.x, p.extractor.breakpoints, p.extractor.paa_segments),
+    'levels_diff': lambda p: _diff_rows(p['levels']),
+    'peak': lambda p: ifeel_extraction._peak_features(p['levels'], p['levels_diff'], p.extractor.alphabet_size,
+                                                      p.sax_interval),
+}
+
+# How each feature is obtained from the intermediate arrays
+_features = {
+    'Mean': lambda p: p['mean'],
+    'Std': lambda p: ifeel_extraction._row_std(p.x, p['mean']),
+    'Max': lambda p: p['max'],
+    'Min': lambda p: p['min'],
+    'Range (i.e., max-min)': lambda p: p['max'] - p['min'],
+    'Percentage above mean': lambda p: ifeel_extraction._row_percentage_above(p.x, p['mean']),
+    'Sum of net loads during business hours': lambda p: ifeel_extraction._row_sum(p.x, p.busi_mask),
+    'Sum of net loads during non-business hours': lambda p: ifeel_extraction._row_sum(p.x, ~p.busi_mask),
+    'Skewness': lambda p: ifeel_extraction._row_moment_stat(skew, p.x),
+    'Kurtosis': lambda p: ifeel_extraction._row_moment_stat(kurtosis, p.x),
+    'Mode of 5-bin histogram': lambda p: ifeel_extraction._row_mode_histogram(p.x, p['min'], p['max']),
+    'Longest period above mean':
+        lambda p: p.sample_interval * ifeel_extraction._longest_run_where(p.x > p['mean'][:, None]),
+    'Longest period of successive increase':
+        lambda p: p.sample_interval * ifeel_extraction._longest_run_where(p['diff'] > 0),
+}
+for _k, _name in enumerate(ifeel_extraction.feature_name_peak):
+    _features[_name] = lambda p, k=_k: p['peak'][k]
+
+
+class _profiles(object):
+    # A batch of daily profiles (rows of the raw data array x) whose intermediate arrays are computed lazily,
+    # i.e., at most once and only when a requested feature needs them
+    def __init__(self, x, busi_mask, sample_interval, extractor):
+        self.x = ifeel_extraction._rows(x)
+        self.busi_mask = busi_mask
+        self.sample_interval = sample_interval
+        # sampling interval of the SAX words, which is longer than that of the raw data with PAA
+        self.sax_interval = sample_interval if extractor.paa_segments is None else 24/extractor.paa_segments
+        self.extractor = extractor
+        self._cache = {}
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            with ifeel_profiling.stage('intermediate: ' + name, self.x.shape[0]):
+                self._cache[name] = _intermediates[name](self)
+        return self._cache[name]
+
+    def features(self, names):
+        # each feature is a profiling stage 'feature: <name>', which includes the intermediates it computes first
+        result = {}
+        for name in names:
+            with ifeel_profiling.stage('feature: ' + name, self.x.shape[0]):
+                result[name] = _features[name](self)
+        return result
+
+
+class feature_extractor(object):
+    # Reusable feature extraction plan: everything that only depends on the parameters (SAX breakpoints, business-hour
+    # masks) is computed once, and only the selected features (and the intermediates they need) are computed.
+    # alphabet_size: alphabet size of SAX representation
+    # time_business_start, time_business_end: business hours, e.g., 9 and 17
+    # sample_interval: in the unit of hour; by default 24 divided by the number of columns of the data
+    # features: names of the features to extract (from feature_name_all); by default all of them
+    # paa_segments: SAX word length (number of segments per day) for the peak-period features, see
+    #               ifeel_transformation.feature_transformation; peak-period features are then given in hours using
+    #               the segment interval 24/paa_segments. By default every sample is discretized.
+    def __init__(self, alphabet_size, time_business_start, time_business_end, sample_interval=None, features=None,
+                 paa_segments=None):
+        if features is None:
+            features = feature_name_all
+        unknown = [name for name in features if name not in _features]
+        if len(unknown) > 0:
+            raise ValueError('Unknown feature name(s): %s' % unknown)
+        ifeel_transformation._check_paa_segments(
+            paa_segments, None if sample_interval is None else int(round(24/sample_interval)))
+        self.alphabet_size = alphabet_size
+        self.time_business_start = time_business_start
+        self.time_business_end = time_business_end
+        self.sample_interval = sample_interval
+        self.features = list(features)
+        self.paa_segments = paa_segments
+        self.breakpoints = ifeel_transformation._sax_breakpoints(alphabet_size)
+        self._busi_masks = {}
+        if sample_interval is not None:
+            self.business_hour_mask(int(round(24/sample_interval)))
+
+    def business_hour_mask(self, columns):
+        # Business-hour mask of the column labels ('HH:MM:SS'), or of the given number of equal intervals per day
+        key = columns if isinstance(columns, int) else tuple(columns)
+        if key not in self._busi_masks:
+            if isinstance(columns, int):
+                mask = ifeel_transformation._business_hour_mask_from_interval(columns, self.time_business_start,
+                                                                              self.time_business_end)
+            else:
+                mask = ifeel_transformation._business_hour_mask(columns, self.time_business_start,
+                                                                self.time_business_end)
+            self._busi_masks[key] = mask
+        return self._busi_masks[key]
+
+    def _sample_interval(self, n_intervals):
+        return 24/n_intervals if self.sample_interval is None else self.sample_interval
+
+    def _extract(self, x, busi_mask, features):
+        return _profiles(x, busi_mask, self._sample_interval(x.shape[1]), self).features(features)
+
+    def extract_array(self, x, index=None, features=None, n_jobs=1):
+        # Features of the daily profiles in the rows of the 2-D array x (days x equal intervals starting at midnight)
+        # features: overrides the features selected at construction
+        # n_jobs: number of worker processes the daily profiles are shared out to (-1: all CPU cores);
+        #         the result is the same as with n_jobs=1 (n_jobs > 1 requires Python 3.8 or later)
+        # return: a DataFrame with one row per daily profile and one column per feature
+        x = ifeel_extraction._rows(x)
+        return self._extract_frame(x, self.business_hour_mask(x.shape[1]), index, features, n_jobs)
+
+    def extract(self, df_test, features=None, n_jobs=1):
+        # Features of the daily profiles in df_test (one row per day, columns are the sampling times 'HH:MM:SS')
+        # df_test is left untouched. See extract_array for the other arguments.
+        x = ifeel_extraction._rows(df_test.to_numpy(dtype=float))
+        return self._extract_frame(x, self.business_hour_mask(df_test.columns), df_test.index, features, n_jobs)
+
+    def _extract_frame(self, x, busi_mask, index, features, n_jobs):
+        if features is None:
+            features = self.features
+        elif any(name not in _features for name in features):
+            raise ValueError('Unknown feature name(s): %s' % [name for name in features if name not in _features])
+        ifeel_transformation._check_paa_segments(self.paa_segments, x.shape[1])
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = max(min(n_jobs, x.shape[0]), 1)
+        if n_jobs == 1:
+            values = self._extract(x, busi_mask, features)
+        else:
+            # the stages of the worker processes are not reported, only the whole parallel extraction
+            with ifeel_profiling.stage('pipeline: parallel extraction (%d jobs)' % n_jobs, x.shape[0]):
+                values = _extract_parallel(self, x, busi_mask, features, n_jobs)
+        return pd.DataFrame(values, index=index, columns=features)
+
+
+def _extract_shard(extractor, shm_name, shape, start, stop, busi_mask, features):
+    # Worker of _extract_parallel: rows [start, stop) of the raw data held in shared memory
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        x = np.ndarray(shape, dtype=float, buffer=shm.buf)[start:stop]
+        values = extractor._extract(x, busi_mask, features)
+        del x   # no view of the shared buffer may be left when it is closed
+        return values
+    finally:
+        shm.close()
+
+
+def _extract_parallel(extractor, x, busi_mask, features, n_jobs):
+    # Same as extractor._extract, with the rows split into n_jobs shards processed by a pool of worker processes.
+    # The raw data is copied once into shared memory, so workers read it without pickling; only the (much smaller)
+    # features are sent back, and they are concatenated in the original row order.
+    # shared_memory requires Python 3.8, so it is only imported here: the rest of IFEEL still runs on Python 3.7.
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+    try:
+        x_shared = np.ndarray(x.shape, dtype=float, buffer=shm.buf)
+        x_shared[:] = x
+        del x_shared
+        bounds = np.linspace(0, x.shape[0], n_jobs + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_extract_shard, extractor, shm.name, x.shape, start, stop, busi_mask, features)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+    return {name: np.concatenate([result[name] for result in results]) for name in features}
+
+
+def feature_extraction(df_test, alphabet_size, time_business_start, time_business_end, sample_interval=None,
+                       n_jobs=1, paa_segments=None):
+    # Global and peak-period features of all daily profiles, straight from the raw data.
+    # Unlike ifeel_transformation.feature_transformation, df_test is left untouched and only the arrays needed by
+    # the extraction are kept, so the five intermediate DataFrames are never built.
+    # df_test: one row per day, columns are the sampling times ('HH:MM:SS')
+    # sample_interval: in the unit of hour; by default 24 divided by the number of columns
+    # n_jobs: number of worker processes the daily profiles are shared out to (-1: all CPU cores);
+    #         the result is the same as with n_jobs=1 (n_jobs > 1 requires Python 3.8 or later)
+    # paa_segments: SAX word length for the peak-period features, see feature_extractor
+    # return: a DataFrame with one row per daily profile and the columns in feature_name_all
+    extractor = feature_extractor(alphabet_size, time_business_start, time_business_end, sample_interval,
+                                  paa_segments=paa_segments)
+    return extractor.extract(df_test, n_jobs=n_jobs)
+
+
+def feature_extraction_chunks(filepath, alphabet_size, time_business_start, time_business_end, chunksize=10000,
+                              sample_interval=None, n_jobs=1, paa_segments=None):
+    # Generator version of feature_extraction for CSV files larger than memory.
+    # filepath: a CSV file in the format of Test_Data (first column is the date, then one column per sampling time)
+    # chunksize: number of daily profiles (rows) read and processed at a time
+    # yield: a DataFrame of features (columns in feature_name_all) for each chunk of rows
+    reader = pd.read_csv(filepath, header=0, index_col=0, chunksize=chunksize)
+    while True:
+        with ifeel_profiling.stage('pipeline: CSV parsing') as parsing:
+            df_chunk = next(reader, None)
+            if df_chunk is None:
+                break
+            parsing.rows = len(df_chunk)
+        yield feature_extraction(df_chunk, alphabet_size, time_business_start, time_business_end, sample_interval,
+                                 n_jobs, paa_segments)
+
+
+def _per_peak_to_lists(features):
+    # Per-peak arrays as plain lists (None for days without peaks), which both CSV and Parquet can store
+    features = features.copy()
+    for name in _feature_name_per_peak:
+        features[name] = [value.tolist() if isinstance(value, np.ndarray) else None for value in features[name]]
+    return features
+
+
+def feature_extraction_file(filepath_in, filepath_out, alphabet_size, time_business_start, time_business_end,
+                            chunksize=10000, sample_interval=None, n_jobs=1, paa_segments=None):
+    # Extract the features of a CSV file chunk by chunk and write them incrementally to filepath_out,
+    # so that the peak memory only depends on chunksize.
+    # filepath_out: a '.parquet' file (requires pyarrow) or otherwise a CSV file
+    # return: the number of daily profiles written
+    chunks = feature_extraction_chunks(filepath_in, alphabet_size, time_business_start, time_business_end,
+                                       chunksize, sample_interval, n_jobs, paa_segments)
+    n_rows = 0
+    if str(filepath_out).endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow; install it with 'pip install pyarrow'")
+        writer = None
+        try:
+            for features in chunks:
+                table = pa.Table.from_pandas(_per_peak_to_lists(features))
+                if writer is None:
+                    # per-peak columns are typed explicitly, since a chunk without any peak gives a null column
+                    schema = table.schema
+                    for name in _feature_name_per_peak:
+                        schema = schema.set(schema.get_field_index(name), pa.field(name, pa.list_(pa.float64())))
+                    writer = pq.ParquetWriter(filepath_out, schema)
+                with ifeel_profiling.stage('pipeline: writing', len(features)):
+                    writer.write_table(table.cast(writer.schema))
+                n_rows += len(features)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for features in chunks:
+            with ifeel_profiling.stage('pipeline: writing', len(features)):
+                _per_peak_to_lists(features).to_csv(filepath_out, mode='w' if n_rows == 0 else 'a',
+                                                    header=n_rows == 0)
+            n_rows += len(features)
+    return n_rows
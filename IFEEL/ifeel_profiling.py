@@ -0,0 +1,141 @@
+import time
+import tracemalloc
+import pandas as pd
+
+# Opt-in instrumentation of the IFEEL stages (CSV parsing, business-hour mask, SAX, each global feature, peak-period
+# features, ...). Each stage reports its wall time, the number of daily profiles (rows) it processed and, when
+# tracemalloc is tracing, the approximate number of bytes it allocated (peak traced memory above the memory in use
+# when the stage started; before Python 3.9, which cannot reset the peak, the traced memory still in use at the end
+# of the stage is taken instead). Reports go to the registered hooks; with no hook registered, a stage costs one
+# check.
+#
+# Example:
+#   with ifeel_profiling.profiler(trace_memory=True) as prof:
+#       ifeel_pipeline.feature_extraction(df_test, 7, 9, 17)
+#   print(prof.report())
+#
+# Stages running in worker processes (n_jobs > 1) are not reported.
+
+_hooks = []
+_stack = []   # memory bookkeeping of the open stages: [memory at start, highest peak of the nested stages]
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)   # Python 3.9 or later
+
+
+def add_hook(callback):
+    # callback(record) is called at the end of every stage, with record a dict:
+    # {'stage': name, 'time': wall time in s, 'rows': rows processed, 'bytes': allocated bytes or None}
+    _hooks.append(callback)
+
+
+def remove_hook(callback):
+    _hooks.remove(callback)
+
+
+class _null_stage(object):
+    # Stage used when no hook is registered: does nothing
+    rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null = _null_stage()
+
+
+class _stage(object):
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if _reset_peak is not None:
+                if len(_stack) > 0 and _stack[-1] is not None:
+                    _stack[-1][1] = max(_stack[-1][1], peak)
+                _reset_peak()
+            _stack.append([current, 0])
+        else:
+            _stack.append(None)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        memory = _stack.pop()
+        allocated = None
+        if memory is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak if _reset_peak is not None else current, memory[1])
+            allocated = max(peak - memory[0], 0)
+            if len(_stack) > 0 and _stack[-1] is not None:
+                _stack[-1][1] = max(_stack[-1][1], peak)
+        record = {'stage': self.name, 'time': elapsed, 'rows': self.rows, 'bytes': allocated}
+        for callback in list(_hooks):
+            callback(record)
+        return False
+
+
+def stage(name, rows=0):
+    # Context manager measuring one stage, e.g.
+    #   with ifeel_profiling.stage('global: Mean', x.shape[0]):
+    #       mean = ...
+    # When the number of rows is only known at the end, it can be set within the stage:
+    #   with ifeel_profiling.stage('pipeline: CSV parsing') as s:
+    #       df_chunk = ...
+    #       s.rows = len(df_chunk)
+    if not _hooks:
+        return _null
+    return _stage(name, rows)
+
+
+class profiler(object):
+    # Hook collecting the records of all stages while it is active (as a context manager, or between start and stop)
+    # trace_memory: also measure allocated bytes, by tracing allocations with tracemalloc (which slows numpy down)
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._started_tracing = False
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        add_hook(self)
+        return self
+
+    def stop(self):
+        remove_hook(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def summary(self):
+        # Totals per stage, slowest first: calls, total and mean wall time (s), rows processed, allocated bytes
+        columns = ['calls', 'time', 'mean time', 'rows', 'bytes']
+        if len(self.records) == 0:
+            return pd.DataFrame(columns=columns)
+        records = pd.DataFrame(self.records)
+        summary = records.groupby('stage', sort=False).agg(calls=('time', 'size'), time=('time', 'sum'),
+                                                          rows=('rows', 'sum'), bytes=('bytes', 'sum'))
+        summary['mean time'] = summary['time'] / summary['calls']
+        if not self.trace_memory:
+            summary['bytes'] = None
+        return summary[columns].sort_values('time', ascending=False)
+
+    def report(self):
+        # The summary as text
+        return self.summary().to_string(float_format=lambda value: '%.6f' % value)
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from . import ifeel_pipeline
+
+# Local feature-extraction service: a warm feature_extractor behind a small HTTP server (TCP or Unix socket).
+# The profiles of concurrent requests are collected into micro-batches, which are extracted with one vectorized call
+# each, so that many clients asking for a handful of daily profiles each share the cost of the extraction.
+#
+# The module is not imported by 'import IFEEL' (clients only need request_features): import it explicitly.
+#
+# Start it with, e.g.:
+#   python -m IFEEL.ifeel_service --alphabet_size 7 --time_business_start 9 --time_business_end 17 --port 8000
+# Endpoints:
+#   POST /features  body {"profiles": [[...], ...], "index": [...] (optional, echoed back)}, one list of readings
+#                   (null if missing) per daily profile, starting at midnight
+#                   reply {"index": [...], "features": [{feature name: value, ...}, ...]} (NaN as null)
+#   GET /metrics    queue depth, batch sizes, latencies, ...
+#   GET /health
+
+
+def _json_value(value):
+    # Feature value as a strict JSON value (NaN as null, per-peak arrays as lists)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class micro_batcher(object):
+    # Collects the profiles submitted concurrently into batches, and extracts each batch with one call of
+    # extractor.extract_array in a worker thread (so the event loop keeps accepting requests meanwhile).
+    # A batch is closed when it holds max_batch_size profiles, or max_wait seconds after its first request arrived.
+    # Profiles of different lengths (sampling intervals) in the same batch are extracted separately.
+    # Must be created and used within a running event loop.
+    def __init__(self, extractor, max_batch_size=512, max_wait=0.005, latency_window=1000):
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._queued_rows = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        # metrics
+        self.n_requests = 0
+        self.n_profiles = 0
+        self.n_batches = 0
+        self.n_errors = 0
+        self.batch_size_max = 0
+        self.last_batch_size = 0
+        self.latencies = collections.deque(maxlen=latency_window)   # seconds, of the latest requests
+
+    async def submit(self, profiles):
+        # profiles: 2-D array (daily profiles x intervals)
+        # return: the DataFrame of features of the profiles, as extractor.extract_array
+        x = np.atleast_2d(np.asarray(profiles, dtype=float))
+        future = asyncio.get_running_loop().create_future()
+        self._queued_rows += x.shape[0]
+        await self._queue.put((x, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        # Wait for a first request, then gather the following ones until the batch is full or max_wait has passed
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        n_rows = batch[0][0].shape[0]
+        deadline = loop.time() + self.max_wait
+        while n_rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            n_rows += item[0].shape[0]
+        self._queued_rows -= n_rows
+        return batch, n_rows
+
+    async def _extract(self, items):
+        # Extract the profiles of the requests in items (all of the same length) with one call, and hand each request
+        # its rows. If the call fails, the requests are retried one by one, so that only those at fault fail.
+        try:
+            x = np.concatenate([item[0] for item in items])
+            features = await asyncio.get_running_loop().run_in_executor(self._executor,
+                                                                        self.extractor.extract_array, x)
+        except Exception as error:
+            if len(items) > 1:
+                for item in items:
+                    await self._extract([item])
+                return
+            self.n_errors += 1
+            if not items[0][1].done():
+                items[0][1].set_exception(error)
+            return
+        start = 0
+        now = time.perf_counter()
+        for x_item, future, submitted in items:
+            stop = start + x_item.shape[0]
+            if not future.done():
+                future.set_result(features.iloc[start:stop].reset_index(drop=True))
+            start = stop
+            self.n_requests += 1
+            self.n_profiles += x_item.shape[0]
+            self.latencies.append(now - submitted)
+
+    async def _run(self):
+        while True:
+            batch, n_rows = await self._next_batch()
+            self.n_batches += 1
+            self.last_batch_size = n_rows
+            self.batch_size_max = max(self.batch_size_max, n_rows)
+            by_length = collections.defaultdict(list)
+            for item in batch:
+                by_length[item[0].shape[1]].append(item)
+            for items in by_length.values():
+                await self._extract(items)
+
+    def metrics(self):
+        latencies = np.array(self.latencies)
+        return {'queue_depth': self._queue.qsize(),
+                'queue_profiles': self._queued_rows,
+                'requests': self.n_requests,
+                'profiles': self.n_profiles,
+                'errors': self.n_errors,
+                'batches': self.n_batches,
+                'batch_size_mean': self.n_profiles / self.n_batches if self.n_batches > 0 else None,
+                'batch_size_max': self.batch_size_max,
+                'last_batch_size': self.last_batch_size,
+                'latency_mean': float(latencies.mean()) if len(latencies) > 0 else None,
+                'latency_p99': float(np.percentile(latencies, 99)) if len(latencies) > 0 else None}
+
+    def close(self):
+        self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+
+class feature_service(object):
+    # HTTP/1.1 front end of a micro_batcher (keep-alive connections, JSON bodies)
+    # extractor: an ifeel_pipeline.feature_extractor, kept for the lifetime of the service
+    _reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+    def __init__(self, extractor, max_batch_size=512, max_wait=0.005):
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batcher = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8000, unix_socket=None):
+        # Listen on host:port, or on the Unix socket file unix_socket if given
+        self.batcher = micro_batcher(self.extractor, self.max_batch_size, self.max_wait)
+        # warm up: the first extraction pays for the lazy imports and allocations. The profile must have as many
+        # samples as the profiles the extractor expects (and at least paa_segments).
+        if self.extractor.sample_interval is not None:
+            n_intervals = int(round(24/self.extractor.sample_interval))
+        else:
+            n_intervals = max(48, self.extractor.paa_segments or 0)
+        self.extractor.extract_array(np.sin(np.linspace(0, 2*np.pi, n_intervals)).reshape(1, -1))
+        if unix_socket is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.close()
+
+    async def _route(self, method, path, body):
+        # return: (status, JSON-serializable reply)
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and path == '/metrics':
+            return 200, self.batcher.metrics()
+        if method != 'POST' or path != '/features':
+            return 404, {'error': 'unknown endpoint %s %s' % (method, path)}
+        try:
+            request = json.loads(body)
+            profiles = np.array(request['profiles'], dtype=float)
+            if profiles.ndim != 2 or profiles.shape[0] == 0:
+                raise ValueError('profiles must be a non-empty list of lists of readings of the same length')
+            if np.isinf(profiles).any():
+                raise ValueError('readings must be finite numbers (or null if missing)')
+            index = request.get('index', list(range(profiles.shape[0])))
+            if len(index) != profiles.shape[0]:
+                raise ValueError('index must have one label per profile')
+        except (ValueError, TypeError, KeyError) as error:
+            return 400, {'error': 'invalid request: %s' % error}
+        try:
+            features = await self.batcher.submit(profiles)
+        except Exception as error:
+            return 500, {'error': 'extraction failed: %s' % error}
+        rows = [{name: _json_value(value) for name, value in row.items()} for row in features.to_dict('records')]
+        return 200, {'index': index, 'features': rows}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+                except ValueError:
+                    status, reply = 400, {'error': 'malformed HTTP request'}
+                    version, headers = 'HTTP/1.0', {}
+                else:
+                    status, reply = await self._route(method, path, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                content = json.dumps(reply).encode()
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n' % (status, self._reasons[status], len(content),
+                                                          'keep-alive' if keep_alive else 'close')).encode()
+                             + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(extractor, host, port, unix_socket, max_batch_size, max_wait):
+    service = feature_service(extractor, max_batch_size, max_wait)
+    server = await service.start(host, port, unix_socket)
+    print('IFEEL feature service listening on %s' % (unix_socket if unix_socket is not None else
+                                                     'http://%s:%d' % (host, port)))
+    try:
+        await server.serve_forever()
+    finally:
+        service.batcher.close()
+
+
+def serve(alphabet_size, time_business_start, time_business_end, host='127.0.0.1', port=8000, unix_socket=None,
+          sample_interval=None, features=None, paa_segments=None, max_batch_size=512, max_wait=0.005):
+    # Run the service until interrupted. See ifeel_pipeline.feature_extractor for the extraction parameters.
+    # max_batch_size: number of profiles at which a batch is extracted without waiting further
+    # max_wait: longest time (s) a request waits for other requests to join its batch
+    extractor = ifeel_pipeline.feature_extractor(alphabet_size, time_business_start, time_business_end,
+                                                 sample_interval, features, paa_segments)
+    try:
+        asyncio.run(_serve(extractor, host, port, unix_socket, max_batch_size, max_wait))
+    except KeyboardInterrupt:
+        pass
+
+
+def request_features(profiles, url='http://127.0.0.1:8000', index=None, timeout=60):
+    # Client helper: features of the profiles (2-D array or list of lists) from a running service
+    # return: the decoded JSON reply, {'index': [...], 'features': [{feature name: value, ...}, ...]}
+    from urllib import request as urllib_request
+    body = {'profiles': [[None if np.isnan(value) else float(value) for value in row]
+                         for row in np.atleast_2d(np.asarray(profiles, dtype=float))]}
+    if index is not None:
+        body['index'] = list(index)
+    http_request = urllib_request.Request(url.rstrip('/') + '/features', data=json.dumps(body).encode(),
+                                          headers={'Content-Type': 'application/json'})
+    with urllib_request.urlopen(http_request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='IFEEL local feature-extraction service')
+    parser.add_argument('--alphabet_size', type=int, default=7)
+    parser.add_argument('--time_business_start', type=int, default=9)
+    parser.add_argument('--time_business_end', type=int, default=17)
+    parser.add_argument('--sample_interval', type=float, default=None,
+                        help='in hours; by default 24 divided by the number of readings of each profile')
+    parser.add_argument('--features', nargs='+', default=None,
+                        help='names of the features to extract (quoted, from feature_name_all); by default all')
+    parser.add_argument('--paa_segments', type=int, default=None)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix_socket', default=None, help='listen on this Unix socket file instead of host:port')
+    parser.add_argument('--max_batch_size', type=int, default=512)
+    parser.add_argument('--max_wait', type=float, default=0.005, help='in seconds')
+    args = parser.parse_args()
+    serve(args.alphabet_size, args.time_business_start, args.time_business_end, args.host, args.port,
+          args.unix_socket, args.sample_interval, args.features, args.paa_segments, args.max_batch_size,
+          args.max_wait)
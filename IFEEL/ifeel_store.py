@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+
+
+def _config_hash(extractor):
+    # Hash of the parameters the feature values depend on: stored features computed with other parameters
+    # (alphabet size, business hours, sampling interval, PAA word length) are not used.
+    # The sampling interval must be given explicitly: by default feature_extractor takes it from the number of columns
+    # of each batch, which the store cannot see when it looks entries up (missing, load, purge).
+    if extractor.sample_interval is None:
+        raise ValueError('feature_store requires a feature_extractor with an explicit sample_interval '
+                         '(e.g., 0.5 for half-hourly profiles)')
+    config = {'alphabet_size': extractor.alphabet_size,
+              'time_business_start': extractor.time_business_start,
+              'time_business_end': extractor.time_business_end,
+              'sample_interval': extractor.sample_interval}
+    if extractor.paa_segments is not None:
+        config['paa_segments'] = extractor.paa_segments
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _encode(features):
+    # One row of features as JSON (per-peak arrays as lists, NaN kept as NaN)
+    return json.dumps({name: value.tolist() if isinstance(value, np.ndarray) else
+                       (int(value) if isinstance(value, (int, np.integer)) else float(value))
+                       for name, value in features.items()})
+
+
+def _decode(text):
+    return {name: np.array(value) if isinstance(value, list) else value for name, value in json.loads(text).items()}
+
+
+class feature_store(object):
+    # Local SQLite file holding the features of every (meter, date), so that only new daily profiles are extracted.
+    # Entries are keyed by (meter, date, config hash); when the extraction parameters change, the stored entries no
+    # longer match and are replaced as the profiles are extracted again (or removed all at once with purge).
+    # The extractors used with the store must be created with an explicit sample_interval.
+    # path: the SQLite file, created if it does not exist
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS features (meter TEXT, date TEXT, config TEXT, '
+                                    'features TEXT, PRIMARY KEY (meter, date, config))')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _keys(index, meter):
+        # (meter, date) strings of each row: index is a (meter, date) MultiIndex, or an index of dates with meter
+        if isinstance(index, pd.MultiIndex):
+            meters, dates = index.get_level_values(0), index.get_level_values(1)
+        else:
+            if meter is None:
+                raise ValueError('meter is required when the index is not a (meter, date) MultiIndex')
+            meters, dates = [meter] * len(index), index
+        dates = pd.to_datetime(dates).strftime('%Y-%m-%d')
+        return list(zip(map(str, meters), dates))
+
+    def _lookup(self, keys, config):
+        # Stored features of the given keys, as a dict {(meter, date): JSON text}
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (meter TEXT, date TEXT)')
+            self.connection.execute('DELETE FROM wanted')
+            self.connection.executemany('INSERT INTO wanted VALUES (?, ?)', keys)
+            rows = self.connection.execute('SELECT f.meter, f.date, f.features FROM features f JOIN wanted w '
+                                           'ON f.meter = w.meter AND f.date = w.date WHERE f.config = ?', (config,))
+            return {(meter, date): text for meter, date, text in rows}
+
+    def missing(self, extractor, index, meter=None):
+        # Boolean array: True for the rows of index whose features (as selected by extractor) are not stored yet
+        features = set(extractor.features)
+        keys = self._keys(index, meter)
+        stored = self._lookup(keys, _config_hash(extractor))
+        return np.array([key not in stored or not features <= set(json.loads(stored[key])) for key in keys],
+                        dtype=bool)
+
+    def extract(self, extractor, profiles, index, meter=None, n_jobs=1):
+        # Features of the daily profiles (rows of the 2-D array profiles, labelled by index), taken from the store
+        # when available; only the other profiles are extracted with extractor and then stored.
+        # return: a DataFrame with one row per profile (in the order of index) and the columns in extractor.features
+        keys = self._keys(index, meter)
+        config = _config_hash(extractor)
+        profiles = np.asarray(profiles)
+        if profiles.shape[1] * extractor.sample_interval != 24:
+            raise ValueError('%d intervals of %g h do not make a day: the profiles do not match the sample_interval '
+                             'of the extractor' % (profiles.shape[1], extractor.sample_interval))
+        stored = self._lookup(keys, config)
+        features = list(extractor.features)
+        cached = {}
+        for key in keys:
+            if key in stored and key not in cached:
+                values = _decode(stored[key])
+                if all(name in values for name in features):
+                    cached[key] = values
+        to_compute = np.array([key not in cached for key in keys], dtype=bool)
+
+        if to_compute.any():
+            computed = extractor.extract_array(profiles[to_compute], features=features, n_jobs=n_jobs)
+            computed_keys = [key for key, flag in zip(keys, to_compute) if flag]
+            computed_rows = computed.to_dict('records')
+            # the features already stored for the same profiles and parameters (e.g., another subset) are kept
+            merged_rows = [_decode(stored[key]) if key in stored else {} for key in computed_keys]
+            for merged_row, row in zip(merged_rows, computed_rows):
+                merged_row.update(row)
+            with self.connection:
+                # entries of the same profiles computed with other parameters are invalid from now on
+                self.connection.executemany('DELETE FROM features WHERE meter = ? AND date = ? AND config != ?',
+                                            [key + (config,) for key in computed_keys])
+                self.connection.executemany('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)',
+                                            [key + (config, _encode(row)) for key, row in
+                                             zip(computed_keys, merged_rows)])
+            for key, row in zip(computed_keys, computed_rows):
+                cached[key] = row
+
+        return pd.DataFrame([cached[key] for key in keys], index=index, columns=features)
+
+    def load(self, extractor):
+        # All stored features computed with the parameters of extractor, with a (meter, date) MultiIndex
+        rows = self.connection.execute('SELECT meter, date, features FROM features WHERE config = ? '
+                                       'ORDER BY meter, date', (_config_hash(extractor),)).fetchall()
+        index = pd.MultiIndex.from_tuples([(meter, pd.Timestamp(date)) for meter, date, _ in rows],
+                                          names=['meter', 'date'])
+        return pd.DataFrame([_decode(text) for _, _, text in rows], index=index,
+                            columns=list(extractor.features))
+
+    def purge(self, extractor=None):
+        # Remove the entries computed with parameters other than those of extractor (all entries if None)
+        # return: the number of entries removed
+        with self.connection:
+            if extractor is None:
+                cursor = self.connection.execute('DELETE FROM features')
+            else:
+                cursor = self.connection.execute('DELETE FROM features WHERE config != ?', (_config_hash(extractor),))
+        return cursor.rowcount
@@ -3,59 +3,193 @@ import pandas as pd
 from scipy.stats import norm
 import string
 from datetime import time, datetime
+from . import ifeel_extraction, ifeel_profiling
 
-def feature_transformation(df_test, alphabet_size, time_business_start, time_business_end):
+
+def _business_hour_mask(columns, time_business_start, time_business_end):
+    # Boolean mask of the columns ('HH:MM:SS' labels) falling within business hours (both ends included)
+    start = time(time_business_start, 00)
+    end = time(time_business_end, 00)
+    is_busi_hour_all = []
+    for time_str in columns:
+        t_test = datetime.strptime(time_str, '%H:%M:%S').time()
+        is_busi_hour_all.append(start <= t_test <= end)
+    return np.array(is_busi_hour_all, dtype=bool)
+
+
+def _business_hour_mask_from_interval(n_intervals, time_business_start, time_business_end):
+    # Same as _business_hour_mask for the columns '00:00:00', ... of n_intervals equal intervals
+    seconds = np.arange(n_intervals) * (24*3600) // n_intervals
+    return (seconds >= time_business_start*3600) & (seconds <= time_business_end*3600)
+
+
+def _interval_labels(n_intervals):
+    # Column labels ('HH:MM:SS') of n_intervals equal intervals starting at midnight
+    seconds = np.arange(n_intervals) * (24*3600) // n_intervals
+    return ['%02d:%02d:%02d' % (s // 3600, s % 3600 // 60, s % 60) for s in seconds]
+
+
+def _sax_breakpoints(alphabet_size):
+    # Breakpoints dividing the standard normal distribution into equiprobable regions
+    # ppf: Percent point function (inverse of cdf)
+    breakpoints = norm.ppf(np.linspace(1. / alphabet_size, 1 - 1. / alphabet_size, alphabet_size - 1))
+    return np.concatenate((breakpoints, np.array([np.inf])))
+
+
+def _ffill_rows(x):
+    # Forward-fill NaNs along each row of a 2-D array (leading NaNs are kept)
+    mask = np.isnan(x)
+    if not mask.any():
+        return x
+    idx = np.where(mask, 0, np.arange(x.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return x[np.arange(x.shape[0])[:, None], idx]
+
+
+def _znorm_rows(x):
+    # Z-normalize each row, skipping NaNs in the same way as pandas' Series.mean() / Series.std(ddof=0)
+    mask = np.isnan(x)
+    count = (~mask).sum(axis=1)[:, None]
+    filled = np.where(mask, 0, x)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=1)[:, None] / count
+        sqr = np.where(mask, 0, (x - mean) ** 2)
+        std = np.sqrt(sqr.sum(axis=1)[:, None] / count)
+        return (x - mean) / std
+
+
+def _paa_rows(x, n_segments):
+    # Piecewise Aggregate Approximation: mean of each row over n_segments equal segments of the day.
+    # When the number of columns is not a multiple of n_segments, the columns shared by two segments are split between
+    # them in proportion to the overlap. NaNs are skipped (a segment with no value is NaN).
+    n_columns = x.shape[1]
+    if n_segments == n_columns:
+        return x
+    # overlap of column i ([i*n_segments, (i+1)*n_segments)) and segment j ([j*n_columns, (j+1)*n_columns))
+    column_edges = np.arange(n_columns + 1) * n_segments
+    segment_edges = np.arange(n_segments + 1) * n_columns
+    overlap = (np.minimum(column_edges[1:, None], segment_edges[None, 1:])
+               - np.maximum(column_edges[:-1, None], segment_edges[None, :-1])).clip(min=0).astype(float)
+    valid = ~np.isnan(x)
+    with np.errstate(invalid='ignore'):
+        return np.where(valid, x, 0) @ overlap / (valid @ overlap)
+
+
+def _check_paa_segments(paa_segments, n_columns=None):
+    # The SAX word length must be a whole number of segments, from 1 to the number of samples per day (n_columns,
+    # if known): PAA can only shorten the daily profiles
+    if paa_segments is None:
+        return
+    if (not isinstance(paa_segments, (int, np.integer)) or paa_segments < 1
+            or (n_columns is not None and paa_segments > n_columns)):
+        raise ValueError('paa_segments must be an integer from 1 to the number of samples per day%s, not %r'
+                         % ('' if n_columns is None else ' (%d)' % n_columns, paa_segments))
+
+
+def _sax_levels(x, breakpoints):
+    # Index of the first breakpoint above each value, i.e. the SAX level (0, 1, ..., alphabet_size-1)
+    # NaNs (e.g. flat or empty daily profiles) get level -1
+    levels = np.searchsorted(breakpoints, x, side='right')
+    levels[np.isnan(x)] = -1
+    return levels
+
+
+# Names of the five outputs of feature_transformation, in the order they are returned
+transformation_outputs = ['raw', 'raw_diff', 'sax_number', 'sax_alphabet', 'sax_number_diff']
+
+
+def feature_transformation(df_test, alphabet_size, time_business_start, time_business_end, compact=False,
+                           outputs=None, paa_segments=None):
     # Symbolic Aggregate ApproXimation (SAX) Transformation
-    def discretizer(ts, breakpoints):
-        return np.where(breakpoints > float(ts))[0][0]
+    # All daily profiles (rows) are z-normalized and discretized at once.
+    # compact: if True, the outputs take less memory: raw data and differences are float32, SAX levels are int8
+    #          (-1 where undefined, e.g., flat daily profiles) and SAX letters are categorical (one byte per letter)
+    # outputs: names of the outputs to compute (from transformation_outputs); the others are returned as None.
+    #          By default all five are computed.
+    # paa_segments: SAX word length, i.e., number of segments per day. If given, the z-normalized profiles are averaged
+    #               over the segments (Piecewise Aggregate Approximation) before discretization, and the SAX outputs
+    #               have one column per segment, so the sampling interval of the peak-period features is
+    #               24/paa_segments. By default every sample is discretized.
 
-    def stringizer(row):
-        return ''.join(string.ascii_letters[int(row['level'])])
+    if outputs is None:
+        outputs = transformation_outputs
+    unknown = [name for name in outputs if name not in transformation_outputs]
+    if len(unknown) > 0:
+        raise ValueError('Unknown output name(s): %s' % unknown)
+    _check_paa_segments(paa_segments, df_test.shape[1])
 
     # add "is_business_hour" to the column, forming a MultiIndex
-    is_busi_hour_all = []
-    for i in np.arange(0, df_test.shape[1]):
-        time_str = df_test.columns[i]
-        t_test = datetime.strptime(time_str, '%H:%M:%S').time()
-        is_busi_hour = lambda t: t >= time(time_business_start, 00) and t <= time(time_business_end, 00)
-        boolean = is_busi_hour(t_test)
-        is_busi_hour_all.append(boolean)
-
-    tuples = list(zip(df_test.columns, is_busi_hour_all))
-    df_test.columns = pd.MultiIndex.from_tuples(tuples, names=('Time', 'business_hour'))
-
-    # SAX representation
-    # SAX words are used for temporal feature extraction
-    df_znorm_all_house = pd.DataFrame()
-    df_SAX_number_all_house = pd.DataFrame()
-    df_SAX_all_house = pd.DataFrame()
-
-    for i in np.arange(0, df_test.shape[0]):
-        df_SAX_each = df_test.iloc[i]
-        x = df_SAX_each.fillna(method='ffill')
-        y = (x - np.mean(x)) / np.std(x)
-        y = pd.DataFrame(y.values)
-        y.columns = ["normalized_power"]
-        breakpoints = norm.ppf(np.linspace(1. / alphabet_size, 1 - 1. / alphabet_size, alphabet_size - 1))    # ppf: Percent point function (inverse of cdf)
-        breakpoints = np.concatenate((breakpoints, np.array([np.Inf])))
-        y['level'] = y.apply(discretizer, axis=1, args=[breakpoints])
-        y['letter'] = y.apply(stringizer, axis=1)
-        # save
-        df_znorm_all_house = df_znorm_all_house.append(y['normalized_power'], ignore_index=True)
-        df_SAX_number_all_house = df_SAX_number_all_house.append(y['level'], ignore_index = True)
-        df_SAX_all_house = df_SAX_all_house.append(y['letter'], ignore_index = True)
-
-
-    df_znorm_all_house.index = df_test.index
-    df_SAX_number_all_house.index = df_test.index
-    df_SAX_all_house.index = df_test.index
-
-    df_znorm_all_house.columns = df_test.columns
-    df_SAX_number_all_house.columns = df_test.columns
-    df_SAX_all_house.columns = df_test.columns
-
-    df_SAX_number_diff_pivot = df_SAX_number_all_house.diff(periods=1, axis=1)
-
-    df_raw_diff = df_test.diff(periods=1, axis=1)
-
-    return df_test, df_raw_diff, df_SAX_number_all_house, df_SAX_all_house, df_SAX_number_diff_pivot
\ No newline at end of file
+    n_rows = df_test.shape[0]
+    with ifeel_profiling.stage('transformation: business-hour mask', n_rows):
+        is_busi_hour_all = _business_hour_mask(df_test.columns, time_business_start, time_business_end)
+        tuples = list(zip(df_test.columns, is_busi_hour_all))
+        df_test.columns = pd.MultiIndex.from_tuples(tuples, names=('Time', 'business_hour'))
+
+    df_raw = df_test
+    if compact and ('raw' in outputs or 'raw_diff' in outputs):
+        df_raw = df_test.astype(np.float32)
+    with ifeel_profiling.stage('transformation: raw diff', n_rows):
+        df_raw_diff = df_raw.diff(periods=1, axis=1) if 'raw_diff' in outputs else None
+
+    df_SAX_number_all_house = None
+    df_SAX_all_house = None
+    df_SAX_number_diff_pivot = None
+    if any(name.startswith('sax') for name in outputs):
+        # SAX representation
+        # SAX words are used for temporal feature extraction
+        breakpoints = _sax_breakpoints(alphabet_size)
+        with ifeel_profiling.stage('transformation: z-normalization', n_rows):
+            x = _ffill_rows(ifeel_extraction._rows(df_test.to_numpy(dtype=float)))
+            y = _znorm_rows(x)
+            del x
+        sax_columns = df_test.columns
+        if paa_segments is not None and paa_segments != y.shape[1]:
+            with ifeel_profiling.stage('transformation: PAA', n_rows):
+                y = _paa_rows(y, paa_segments)
+            sax_columns = pd.MultiIndex.from_arrays(
+                [_interval_labels(paa_segments),
+                 _business_hour_mask_from_interval(paa_segments, time_business_start, time_business_end)],
+                names=('Time', 'business_hour'))
+        with ifeel_profiling.stage('transformation: SAX levels', n_rows):
+            levels = _sax_levels(y, breakpoints)
+        del y
+        is_undefined = levels < 0
+
+        if 'sax_number' in outputs or (not compact and 'sax_number_diff' in outputs):
+            if compact:
+                df_SAX_number_all_house = pd.DataFrame(levels.astype(np.int8), index=df_test.index,
+                                                       columns=sax_columns)
+            else:
+                if is_undefined.any():
+                    levels_float = np.where(is_undefined, np.nan, levels)
+                    df_SAX_number_all_house = pd.DataFrame(levels_float, index=df_test.index, columns=sax_columns)
+                else:
+                    df_SAX_number_all_house = pd.DataFrame(levels, index=df_test.index, columns=sax_columns)
+
+        if 'sax_alphabet' in outputs:
+            with ifeel_profiling.stage('transformation: SAX letters', n_rows):
+                if compact:
+                    categories = list(string.ascii_letters[:alphabet_size])
+                    df_SAX_all_house = pd.DataFrame({i: pd.Categorical.from_codes(levels[:, i], categories)
+                                                     for i in range(levels.shape[1])}, index=df_test.index)
+                    df_SAX_all_house.columns = sax_columns
+                else:
+                    letters = np.array(list(string.ascii_letters), dtype=object)[levels]
+                    letters[is_undefined] = np.nan
+                    df_SAX_all_house = pd.DataFrame(letters, index=df_test.index, columns=sax_columns)
+
+        if 'sax_number_diff' in outputs:
+            with ifeel_profiling.stage('transformation: SAX diff', n_rows):
+                if compact:
+                    levels_float = np.where(is_undefined, np.nan, levels).astype(np.float32)
+                    df_SAX_number_diff_pivot = pd.DataFrame(levels_float, index=df_test.index,
+                                                            columns=sax_columns).diff(periods=1, axis=1)
+                else:
+                    df_SAX_number_diff_pivot = df_SAX_number_all_house.diff(periods=1, axis=1)
+                if 'sax_number' not in outputs:
+                    df_SAX_number_all_house = None
+
+    if 'raw' not in outputs:
+        df_raw = None
+
+    return df_raw, df_raw_diff, df_SAX_number_all_house, df_SAX_all_house, df_SAX_number_diff_pivot
@@ -0,0 +1,224 @@
+# Benchmark suite of IFEEL: time and peak memory of each stage on synthetic daily profiles, at several numbers of
+# days and sampling intervals, plus equivalence checks:
+#   - the features of the test datasets must match those computed by the original (row-by-row) implementation,
+#     saved in baselines/reference_features.json;
+#   - on every synthetic dataset, the batch extractors must match the single-profile feature_global /
+#     feature_peak_period on a sample of days;
+#   - the feature store must not serve features computed at another sampling interval, nor drop the features of
+#     another subset;
+#   - long-format readings with UTC offsets must be binned on the local wall clock across daylight saving changes.
+# Timings can be saved as a baseline and later compared with it to catch performance regressions.
+# Usage (from the root of the repository):
+#   python benchmarks/bench_ifeel.py --days 1000 10000 --resolutions 2h 30min 1min --save benchmarks/baselines/timings.json
+#   python benchmarks/bench_ifeel.py --days 1000 10000 --resolutions 2h 30min 1min --compare benchmarks/baselines/timings.json
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+from IFEEL import ifeel_transformation, ifeel_extraction, ifeel_pipeline, ifeel_store, ifeel_ingest
+from synthetic import synthetic_profiles
+
+alphabet_size = 7
+time_business_start = 9
+time_business_end = 17
+
+
+def stages(df_test, sample_interval):
+    # The three stages of IFEEL, each as a function of the outputs of the previous ones
+    outputs = {}
+
+    def transformation():
+        outputs['transformation'] = ifeel_transformation.feature_transformation(
+            df_test.copy(), alphabet_size, time_business_start, time_business_end)
+
+    def global_features():
+        df_raw, df_raw_diff = outputs['transformation'][:2]
+        outputs['global'] = ifeel_extraction.feature_global_batch(df_raw, df_raw_diff, sample_interval)
+
+    def peak_features():
+        df_SAX_number, df_SAX_number_diff = outputs['transformation'][2], outputs['transformation'][4]
+        outputs['peak'] = ifeel_extraction.feature_peak_period_batch(df_SAX_number, df_SAX_number_diff,
+                                                                     alphabet_size, sample_interval)
+
+    return [('feature_transformation', transformation), ('feature_global', global_features),
+            ('feature_peak_period', peak_features)], outputs
+
+
+def measure(df_test, sample_interval):
+    # Wall time (s) of each stage, then peak memory (MB) of each stage in a second run, since tracing allocations
+    # slows numpy down
+    result = {}
+    functions, outputs = stages(df_test, sample_interval)
+    for name, function in functions:
+        start = time.perf_counter()
+        function()
+        result[name] = {'time': time.perf_counter() - start}
+    functions, _ = stages(df_test, sample_interval)
+    for name, function in functions:
+        tracemalloc.start()
+        function()
+        result[name]['peak_memory'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, outputs
+
+
+def same_value(a, b, rtol=0):
+    if isinstance(a, (list, np.ndarray)) or isinstance(b, (list, np.ndarray)):
+        return isinstance(a, (list, np.ndarray)) and isinstance(b, (list, np.ndarray)) and np.array_equal(a, b)
+    if pd.isna(a) or pd.isna(b):
+        return pd.isna(a) and pd.isna(b)
+    return abs(a - b) <= rtol * abs(b)
+
+
+def check_reference(data_dir):
+    # Features of the test datasets against those of the original implementation. Skewness and kurtosis may differ
+    # in the last digit (array vs scalar power in scipy); all other features must be identical.
+    reference = json.load(open(os.path.join(here, 'baselines', 'reference_features.json')))
+    for filename, rows in reference['features'].items():
+        df_test = pd.read_csv(os.path.join(data_dir, filename), header=0, index_col=0)
+        sample_interval = 24/df_test.shape[1]
+        df_raw, df_raw_diff, df_SAX_number, _, df_SAX_number_diff = ifeel_transformation.feature_transformation(
+            df_test, reference['alphabet_size'], reference['time_business_start'], reference['time_business_end'])
+        features = pd.concat([
+            ifeel_extraction.feature_global_batch(df_raw, df_raw_diff, sample_interval),
+            ifeel_extraction.feature_peak_period_batch(df_SAX_number, df_SAX_number_diff, reference['alphabet_size'],
+                                                       sample_interval)], axis=1)
+        for i, row in enumerate(rows):
+            for name, value in row.items():
+                rtol = 1e-13 if name in ('Skewness', 'Kurtosis') else 0
+                if not same_value(features[name].iloc[i], value, rtol):
+                    raise AssertionError('%s, day %d, %s: %r instead of %r'
+                                         % (filename, i, name, features[name].iloc[i], value))
+    print('Reference features of %d test datasets: OK' % len(reference['features']))
+
+
+def check_single_profile(outputs, sample_interval, n_sample=20, seed=0):
+    # Batch extractors against the single-profile feature_global / feature_peak_period on a sample of days
+    df_raw, df_raw_diff, df_SAX_number, _, df_SAX_number_diff = outputs['transformation']
+    rows = np.random.default_rng(seed).choice(df_raw.shape[0], min(n_sample, df_raw.shape[0]), replace=False)
+    for i in rows:
+        single_global = ifeel_extraction.feature_global(df_raw.iloc[i], df_raw_diff.iloc[i],
+                                                        sample_interval).global_all()[0].tolist()
+        single_peak = ifeel_extraction.feature_peak_period(df_SAX_number.iloc[i], df_SAX_number_diff.iloc[i],
+                                                           alphabet_size, sample_interval)[0].tolist()
+        batch = outputs['global'].iloc[i].tolist() + outputs['peak'].iloc[i].tolist()
+        for name, a, b in zip(ifeel_extraction.feature_name_global + ifeel_extraction.feature_name_peak,
+                              single_global + single_peak, batch):
+            if not same_value(a, b):
+                raise AssertionError('day %d, %s: batch %r, single profile %r' % (i, name, b, a))
+
+
+def check_store():
+    # The same (meter, date) extracted at 30 min and then at 1 h: the second extraction must not get the stored
+    # features of the first one
+    profiles_30min = synthetic_profiles(1, 48).to_numpy()
+    profiles_1h = np.nanmean(profiles_30min.reshape(1, 24, 2), axis=2)
+    index = pd.MultiIndex.from_tuples([('meter', pd.Timestamp('2021-01-01'))], names=['meter', 'date'])
+    with tempfile.TemporaryDirectory() as directory:
+        with ifeel_store.feature_store(os.path.join(directory, 'features.sqlite')) as store:
+            for profiles, sample_interval in ((profiles_30min, 0.5), (profiles_1h, 1.0)):
+                extractor = ifeel_pipeline.feature_extractor(alphabet_size, time_business_start, time_business_end,
+                                                             sample_interval)
+                expected = extractor.extract_array(profiles, index)
+                stored = store.extract(extractor, profiles, index)
+                if not all(same_value(a, b) for a, b in zip(stored.iloc[0], expected.iloc[0])):
+                    raise AssertionError('feature store, %g h interval: stored features of another interval'
+                                         % sample_interval)
+            # without an explicit interval, the store cannot tell 30-min and 1-h profiles apart
+            try:
+                store.extract(ifeel_pipeline.feature_extractor(alphabet_size, time_business_start, time_business_end),
+                              profiles_30min, index)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('feature store: extractor without sample_interval accepted')
+            # extracting another subset of features must keep the features already stored
+            extractors = [ifeel_pipeline.feature_extractor(alphabet_size, time_business_start, time_business_end,
+                                                           1.0, features) for features in
+                          (ifeel_extraction.feature_name_global, ifeel_extraction.feature_name_peak)]
+            index_new = pd.MultiIndex.from_tuples([('meter', pd.Timestamp('2021-01-02'))], names=['meter', 'date'])
+            for extractor in extractors:
+                store.extract(extractor, profiles_1h, index_new)
+            if any(store.missing(extractor, index_new).any() for extractor in extractors):
+                raise AssertionError('feature store: features of another subset evicted')
+    print('Feature store across sampling intervals: OK')
+
+
+def check_ingest_dst():
+    # Half-hourly readings around the spring and autumn changes of 2021 in London, exported as ISO strings with their
+    # UTC offset; each reading is the index of its local half hour. On the spring day, the skipped hour (01:00-02:00)
+    # is forward-filled; on the autumn day, the two readings of each repeated half hour are averaged.
+    expected = np.tile(np.arange(48.), (3, 1))
+    expected_spring = expected.copy()
+    expected_spring[1, 2:4] = 1
+    for start, expected_profiles in (('2021-03-27', expected_spring), ('2021-10-30', expected)):
+        times = pd.date_range(start, periods=3, freq='D', tz='Europe/London')
+        times = pd.date_range(times[0], pd.Timestamp(times[-1]) + pd.Timedelta('23h30min'), freq='30min')
+        df_long = pd.DataFrame({'meter_id': 'meter', 'timestamp': times.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                                'value': times.hour * 2 + times.minute // 30})
+        profiles, index = ifeel_ingest.daily_profiles(df_long, timezone='Europe/London')
+        if not (np.array_equal(profiles, expected_profiles)
+                and list(index.get_level_values('date')) == list(pd.date_range(start, periods=3, freq='D'))):
+            raise AssertionError('daily_profiles across the daylight saving change of %s' % start)
+    print('Long-format readings across daylight saving changes: OK')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--resolutions', nargs='+', default=['2h', '1h', '30min', '15min', '1min'])
+    parser.add_argument('--max_cells', type=float, default=5e7,
+                        help='skip the datasets with more days x intervals than this')
+    parser.add_argument('--data', default=os.path.join(here, '..', 'Test_Data'))
+    parser.add_argument('--save', help='save the results as a baseline (JSON)')
+    parser.add_argument('--compare', help='compare the timings with a saved baseline (JSON)')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='a stage slower than tolerance x its baseline time is a regression')
+    args = parser.parse_args()
+
+    check_reference(args.data)
+    check_store()
+    check_ingest_dst()
+
+    results = {}
+    print('%8s %10s  %-24s %10s %14s' % ('days', 'interval', 'stage', 'time (s)', 'peak mem (MB)'))
+    for resolution in args.resolutions:
+        n_intervals = int(pd.Timedelta('1D') / pd.Timedelta(resolution))
+        sample_interval = 24/n_intervals
+        for n_days in args.days:
+            if n_days * n_intervals > args.max_cells:
+                continue
+            df_test = synthetic_profiles(n_days, n_intervals)
+            result, outputs = measure(df_test, sample_interval)
+            check_single_profile(outputs, sample_interval)
+            key = '%d days x %s' % (n_days, resolution)
+            results[key] = result
+            for stage, values in result.items():
+                print('%8d %10s  %-24s %10.3f %14.1f' % (n_days, resolution, stage, values['time'],
+                                                         values['peak_memory']))
+    print('Batch vs single-profile features on all synthetic datasets: OK')
+
+    if args.save:
+        json.dump(results, open(args.save, 'w'), indent=1)
+        print('Baseline saved to %s' % args.save)
+
+    if args.compare:
+        baseline = json.load(open(args.compare))
+        regressions = [(key, stage, values['time'], baseline[key][stage]['time'])
+                       for key, result in results.items() if key in baseline
+                       for stage, values in result.items()
+                       if values['time'] > args.tolerance * baseline[key][stage]['time']]
+        for key, stage, current, previous in regressions:
+            print('REGRESSION %s, %s: %.3f s (baseline %.3f s)' % (key, stage, current, previous))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regression against %s' % args.compare)
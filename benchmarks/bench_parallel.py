@@ -0,0 +1,53 @@
+# Benchmark of the multi-core feature extraction (IFEEL.ifeel_pipeline.feature_extraction with n_jobs).
+# A synthetic dataset (see synthetic.py) is processed with an increasing number of worker processes.
+# The features must be the same as the serial ones.
+# Usage (from the root of the repository):
+#   python benchmarks/bench_parallel.py --days 200000 --resolution 30min --jobs 1 2 4 8 16 32
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from IFEEL import ifeel_pipeline
+from synthetic import synthetic_profiles
+
+
+def same_features(a, b):
+    # Element-wise comparison, including the per-peak arrays
+    for name in a.columns:
+        for x, y in zip(a[name], b[name]):
+            if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+                if not np.array_equal(x, y):
+                    return False
+            elif not (x == y or (pd.isna(x) and pd.isna(y))):
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=100000)
+    parser.add_argument('--resolution', default='30min')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--alphabet_size', type=int, default=7)
+    args = parser.parse_args()
+
+    df_test = synthetic_profiles(args.days, int(pd.Timedelta('1D') / pd.Timedelta(args.resolution)))
+    print('%d daily profiles x %d intervals, %d CPU cores' % (df_test.shape[0], df_test.shape[1], os.cpu_count()))
+
+    serial = None
+    time_serial = None
+    print('n_jobs  time (s)  speed-up')
+    for n_jobs in args.jobs:
+        start = time.perf_counter()
+        features = ifeel_pipeline.feature_extraction(df_test, args.alphabet_size, 9, 17, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - start
+        if serial is None:
+            serial, time_serial = features, elapsed
+        elif not same_features(features, serial):
+            raise AssertionError('features with n_jobs=%d differ from those with n_jobs=%d' % (n_jobs, args.jobs[0]))
+        print('%6d  %8.2f  %8.2f' % (n_jobs, elapsed, time_serial / elapsed))
@@ -0,0 +1,31 @@
+# Synthetic daily load profiles for benchmarking IFEEL at any scale.
+# Each day is a base load plus a morning and an evening peak (random time, width and height) and multiplicative
+# noise; some readings are missing and some days are flat (e.g., vacant house or meter fault).
+
+import numpy as np
+import pandas as pd
+from IFEEL.ifeel_transformation import _interval_labels
+
+
+def synthetic_profiles(n_days, n_intervals=48, nan_fraction=0.001, flat_fraction=0.01, seed=0):
+    # n_days synthetic daily profiles (kW) at n_intervals intervals per day, as a DataFrame in the format of Test_Data
+    # nan_fraction: fraction of missing readings (never in the first interval of the day)
+    # flat_fraction: fraction of days with a constant load
+    rng = np.random.default_rng(seed)
+    hours = np.arange(n_intervals) * 24 / n_intervals
+    base = rng.uniform(0.05, 0.4, (n_days, 1))
+    profiles = np.repeat(base, n_intervals, axis=1)
+    for centre, spread in ((7.5, 1.0), (19, 1.5)):
+        time_peak = rng.normal(centre, spread, (n_days, 1))
+        width = rng.uniform(0.3, 1.5, (n_days, 1))
+        height = rng.gamma(2, 0.4, (n_days, 1))
+        profiles += height * np.exp(-0.5 * ((hours - time_peak) / width) ** 2)
+    profiles *= rng.gamma(20, 1/20, profiles.shape)
+
+    flat = rng.random(n_days) < flat_fraction
+    profiles[flat] = base[flat]
+    missing = rng.random(profiles.shape) < nan_fraction
+    missing[:, 0] = False
+    profiles[missing] = np.nan
+
+    return pd.DataFrame(profiles, index=pd.RangeIndex(n_days, name='day'), columns=_interval_labels(n_intervals))